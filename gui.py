@@ -1,82 +1,67 @@
 import os
+import json
+import re
 import sys
 import queue
 import logging
 import threading
+from logging.handlers import QueueHandler
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext
 
-import yaml # PyYAML
-
-class IORedirector(object):
-    def __init__(self, text_widget):
-        self.text_widget = text_widget
-        self.queue = queue.Queue()
-        self.updating = True
-        self.buffer = []
-        self.last_update = 0
-        self._redirect_setup()
-        threading.Thread(target=self._update_text_widget, daemon=True).start()
-
-    def _redirect_setup(self):
-        # 保存原始的stdout和stderr
-        self.original_stdout = sys.stdout
-        self.original_stderr = sys.stderr
-        
-        # 只重定向一次
-        if not isinstance(sys.stdout, IORedirector):
-            sys.stdout = self
-        if not isinstance(sys.stderr, IORedirector):
-            sys.stderr = self
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# 日志区域保留的最大行数，以及触发裁剪前允许超出的行数
+LOG_MAX_LINES = 1000
+LOG_TRIM_SLACK = 200
+# 日志写入文本框的合并间隔（毫秒）
+LOG_FLUSH_INTERVAL = 100
+# 配置修改后延迟保存的毫秒数，期间的多次修改只写一次文件
+CONFIG_SAVE_DELAY = 500
+
+# ANSI转义序列及除换行、回车、制表符外的控制字符
+_ANSI_RE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+_CTRL_TBL = {c: None for c in range(32) if chr(c) not in '\n\r\t'}
+
+class StreamToLogger(object):
+    """将stdout/stderr的写入转发到日志记录器"""
+    def __init__(self, logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
 
     def write(self, string):
-        if string.strip():
-            import re
-            clean_string = re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', string)
-            clean_string = ''.join(char for char in clean_string if ord(char) >= 32 or char in '\n\r\t')
-            if clean_string.strip():
-                self.queue.put(clean_string)
+        string = _ANSI_RE.sub('', string).translate(_CTRL_TBL)
+        for line in string.splitlines():
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
 
     def flush(self):
         pass
 
-    def _update_text_widget(self):
-        import time
-        while self.updating:
-            try:
-                while True:
-                    string = self.queue.get_nowait()
-                    self.buffer.append(string)
-                    
-                    current_time = time.time()
-                    if len(self.buffer) >= 10 or (current_time - self.last_update) > 0.1:
-                        combined_text = ''.join(self.buffer)
-                        self.text_widget.after(0, lambda t=combined_text: self._safe_update(t))
-                        self.buffer = []
-                        self.last_update = current_time
-                        
-            except queue.Empty:
-                if self.buffer:
-                    combined_text = ''.join(self.buffer)
-                    self.text_widget.after(0, lambda t=combined_text: self._safe_update(t))
-                    self.buffer = []
-                    self.last_update = time.time()
-                time.sleep(0.1)
-
-    def _safe_update(self, text):
-        try:
-            current_length = float(self.text_widget.index('end-1c'))
-            if current_length > 1000:
-                self.text_widget.delete('1.0', f'{current_length-1000}.0')
-            
-            self.text_widget.insert(tk.END, text)
-            self.text_widget.see(tk.END)
-        except Exception as e:
-            print(f"Error updating text widget: {e}", file=self.original_stderr)
+class TkQueueHandler(QueueHandler):
+    """日志放入队列后按需安排一次界面刷新，没有日志时不会定时唤醒"""
+    def __init__(self, log_queue, root, flush_callback):
+        super().__init__(log_queue)
+        self.root = root
+        self.flush_callback = flush_callback
+        self._flush_pending = False
+        self._pending_lock = threading.Lock()
 
-    def __del__(self):
-        sys.stdout = self.original_stdout
-        sys.stderr = self.original_stderr
+    def handle(self, record):
+        rv = super().handle(record)
+        # 在处理器锁之外安排刷新：其他线程调用after需要等待主线程响应，
+        # 若此时持有处理器锁而主线程也在写日志，会互相等待
+        with self._pending_lock:
+            if self._flush_pending:
+                return rv
+            self._flush_pending = True
+        # 等待LOG_FLUSH_INTERVAL毫秒，把这段时间内的日志合并为一次刷新
+        self.root.after(LOG_FLUSH_INTERVAL, self.flush_callback)
+        return rv
+
+    def flush_started(self):
+        """刷新开始时调用，之后到达的日志会安排新的刷新"""
+        with self._pending_lock:
+            self._flush_pending = False
 
 class PDFOrientationGUI:
     def __init__(self, root):
@@ -86,6 +71,10 @@ class PDFOrientationGUI:
         
         # 配置文件路径
         self.config_file = "config.yaml"
+        self._config_lock = threading.Lock()
+        self._save_job = None
+        # 配置文件中的全部配置，界面上没有的项（如workers、ocr_qps）保存时原样写回
+        self.config = {}
         
         if hasattr(sys, 'getwindowsversion'):
             self.root.option_add('*font', ('Microsoft YaHei UI', 9))
@@ -121,35 +110,73 @@ class PDFOrientationGUI:
         try:
             if os.path.exists(self.config_file):
                 with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = yaml.safe_load(f)
-                    if config:  # 确保配置不为空
-                        self.api_key_var.set(config.get('api_key', ''))
-                        self.secret_key_var.set(config.get('secret_key', ''))
-                        self.input_folder_var.set(config.get('input_folder', ''))
-                        self.output_folder_var.set(config.get('output_folder', ''))
-                        self.debug_var.set(config.get('debug', False))
+                    content = f.read()
+                try:
+                    config = json.loads(content)
+                except ValueError:
+                    # 旧版本保存的YAML格式配置，下次保存时转为JSON
+                    import yaml # PyYAML
+                    config = yaml.safe_load(content)
+                if config:  # 确保配置不为空
+                    self.config = config
+                    self.api_key_var.set(config.get('api_key', ''))
+                    self.secret_key_var.set(config.get('secret_key', ''))
+                    self.input_folder_var.set(config.get('input_folder', ''))
+                    self.output_folder_var.set(config.get('output_folder', ''))
+                    self.debug_var.set(config.get('debug', False))
         except Exception as e:
             logging.error(f"加载配置文件失败: {e}")
 
     def save_config(self):
-        """保存当前配置"""
+        """保存当前配置，短时间内的多次调用合并为一次写入"""
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+        self._save_job = self.root.after(CONFIG_SAVE_DELAY, self._save_config_async)
+
+    def _save_config_async(self):
+        # 在主线程读取界面上的值，文件写入交给后台线程，避免慢速磁盘卡住界面
+        self._save_job = None
+        data = self._dump_config()
+        threading.Thread(target=self._write_config_atomic, args=(data,), daemon=True).start()
+
+    def _dump_config(self):
+        config = self._current_config()
+        # JSON同时也是合法的YAML，命令行的--config仍可直接读取
+        return json.dumps(config, ensure_ascii=False, indent=2)
+
+    def _current_config(self):
+        """配置文件中的配置，以界面上填写的值为准"""
+        config = dict(self.config)
+        config.update({
+            'api_key': self.api_key_var.get(),
+            'secret_key': self.secret_key_var.get(),
+            'input_folder': self.input_folder_var.get(),
+            'output_folder': self.output_folder_var.get(),
+            'debug': self.debug_var.get()
+        })
+        return config
+
+    def _write_config_atomic(self, data):
+        """先写临时文件再替换，写入中断时不会损坏原配置"""
         try:
-            config = {
-                'api_key': self.api_key_var.get(),
-                'secret_key': self.secret_key_var.get(),
-                'input_folder': self.input_folder_var.get(),
-                'output_folder': self.output_folder_var.get(),
-                'debug': self.debug_var.get()
-            }
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                yaml.safe_dump(config, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+            with self._config_lock:
+                tmp_file = self.config_file + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_file, self.config_file)
             logging.info("配置已保存")
         except Exception as e:
             logging.error(f"保存配置文件失败: {e}")
 
     def on_closing(self):
         """窗口关闭时的处理"""
-        self.save_config()
+        # 退出时同步写入，后台线程会随进程结束而中断
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+            self._save_job = None
+        self._write_config_atomic(self._dump_config())
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
         self.root.destroy()
 
     def create_input_fields(self):
@@ -197,8 +224,39 @@ class PDFOrientationGUI:
         )
         self.log_text.pack(fill=tk.BOTH, expand=True)
         
-        # 创建单个IORedirector实例
-        self.io_redirector = IORedirector(self.log_text)
+        # 日志记录先放入队列，由主线程定时批量写入文本框
+        self.log_queue = queue.Queue(-1)
+        self._line_count = 0
+        self.log_handler = TkQueueHandler(self.log_queue, self.root, self._flush_log)
+        self.log_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%H:%M:%S'))
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        root_logger.addHandler(self.log_handler)
+
+        # print输出及未捕获的异常信息也显示在日志区域
+        sys.stdout = StreamToLogger(logging.getLogger("stdout"), logging.INFO)
+        sys.stderr = StreamToLogger(logging.getLogger("stderr"), logging.ERROR)
+
+    def _flush_log(self):
+        """取出队列中的全部日志，合并为一次插入"""
+        self.log_handler.flush_started()
+        parts = []
+        try:
+            while True:
+                parts.append(self.log_queue.get_nowait().getMessage())
+        except queue.Empty:
+            pass
+
+        if parts:
+            text = '\n'.join(parts) + '\n'
+            self.log_text.insert(tk.END, text)
+            self._line_count += text.count('\n')
+            # 超出上限一定行数后才裁剪，避免每次更新都删除
+            if self._line_count > LOG_MAX_LINES + LOG_TRIM_SLACK:
+                self.log_text.delete('1.0', f'{self._line_count - LOG_MAX_LINES + 1}.0')
+                self._line_count = LOG_MAX_LINES
+            self.log_text.see(tk.END)
 
     def create_buttons(self):
         button_frame = ttk.Frame(self.main_frame)
@@ -206,7 +264,7 @@ class PDFOrientationGUI:
         
         ttk.Button(button_frame, text="开始处理", command=self.start_processing).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="清除日志", command=self.clear_log).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="退出", command=self.root.quit).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="退出", command=self.on_closing).pack(side=tk.LEFT, padx=5)
 
     def browse_input_folder(self):
         folder = filedialog.askdirectory()
@@ -229,17 +287,14 @@ class PDFOrientationGUI:
 
     def clear_log(self):
         self.log_text.delete('1.0', tk.END)
+        self._line_count = 0
         self.log_text.update_idletasks()
 
     def start_processing(self):
-        # 获取输入值
-        config = {
-            'api_key': self.api_key_var.get(),
-            'secret_key': self.secret_key_var.get(),
-            'input_folder': self.input_folder_var.get(),
-            'output_folder': self.output_folder_var.get(),
-            'debug': self.debug_var.get()
-        }
+        # 获取输入值，界面上没有的配置项（workers、procs、ocr_qps、local_skip）取自配置文件
+        config = self._current_config()
+        # 子进程的日志无法显示在日志区域，界面中总是在本进程内逐个处理文件
+        config['procs'] = 1
 
         # 验证输入
         if not all([config['api_key'], config['secret_key'], config['input_folder']]):
@@ -262,8 +317,8 @@ class PDFOrientationGUI:
             # 导入主程序
             from main import setup_logging, process_folder
             
-            # 设置日志
-            setup_logging(config['debug'])
+            # 设置日志，输出到日志区域
+            setup_logging(config['debug'], self.log_handler)
             
             # 处理文件夹
             process_folder(config, progress_callback)
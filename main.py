@@ -1,20 +1,69 @@
-import io
 import os
+import json
 import sys
 import logging
 import argparse
 import base64
+import math
 import time
-from threading import Lock
+import random
+import shutil
+import hashlib
+import sqlite3
+import statistics
+from collections import Counter, OrderedDict
+import functools
+import contextlib
+from threading import Lock, BoundedSemaphore
+from urllib.parse import urlencode
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-import fitz  # PyMuPDF
 import yaml # PyYAML
-import requests # requests
-from PIL import Image # Pillow
 
+# 送去OCR的页面图像的渲染分辨率及长边像素上限
+OCR_DPI = 96
+OCR_MAX_EDGE = 1024
+# 百度接口要求图片base64编码后不超过4MB，编码会增大约1/3
+OCR_MAX_BYTES = 3 * 1024 * 1024
 
-def setup_logging(debug=False):
-    """配置日志记录器"""
+# 请求百度接口的连接超时和读取超时（秒）
+REQUEST_TIMEOUT = (3, 15)
+# 百度接口每秒允许的请求数的默认值（免费额度），多进程处理时由各进程平分
+OCR_QPS = 2
+# 百度OCR返回的direction对应的旋转角度: 0:正向，1:逆时针90度，2:逆时针180度，3:逆时针270度
+_BAIDU_DIR = (0, 90, 180, 270)
+
+# 本地缓存目录，存放access_token和OCR结果
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pdf_auto_fix")
+TOKEN_CACHE_FILE = os.path.join(CACHE_DIR, "token.json")
+# 多个进程同时获取access_token时使用的锁文件
+TOKEN_LOCK_FILE = TOKEN_CACHE_FILE + ".lock"
+# 百度接口表示access_token无效(110)或过期(111)的错误码
+TOKEN_ERROR_CODES = (110, 111)
+# 百度接口表示请求过于频繁的错误码(4: 集群超限，18: QPS超限)，稍后重试即可
+RATE_LIMIT_ERROR_CODES = (4, 18)
+# 被限流时的最大重试次数，及首次重试前的等待时间（秒），之后每次加倍
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 0.5
+
+# 每成功识别多少次后按成功次数重新排列接口
+API_REORDER_INTERVAL = 20
+
+# 文字层字符数超过该值的页面根据文字方向判断，不再调用OCR
+TEXT_LAYER_MIN_CHARS = 50
+# 直接使用内嵌JPEG时，图片至少需覆盖的页面面积比例
+FAST_PATH_MIN_COVERAGE = 0.8
+# 本地预检的渲染长边像素数，以及行/列投影方差比的判定阈值
+LOCAL_CHECK_EDGE = 400
+LOCAL_CHECK_RATIO = 2.5
+# 灰度值到二值（深色为1）的转换表
+_DARK_PIXEL_TABLE = bytes(1 if v < 128 else 0 for v in range(256))
+# OCR方向结果的持久化缓存文件，及内存中保留的条数上限
+ORIENTATION_CACHE_FILE = os.path.join(CACHE_DIR, "ocr_cache.sqlite")
+ORIENTATION_CACHE_SIZE = 4096
+
+def setup_logging(debug=False, handler=None):
+    """配置日志记录器，未指定handler时输出到控制台"""
     level = logging.DEBUG if debug else logging.INFO
     
     # 自定义日志格式
@@ -29,22 +78,34 @@ def setup_logging(debug=False):
 
         format_str = "%(asctime)s - %(levelname)s - %(message)s"
 
-        FORMATS = {
-            logging.DEBUG: grey + format_str + reset,
-            logging.INFO: blue + format_str + reset,
-            logging.WARNING: yellow + format_str + reset,
-            logging.ERROR: red + format_str + reset,
-            logging.CRITICAL: bold_red + format_str + reset
+        COLORS = {
+            logging.DEBUG: grey,
+            logging.INFO: blue,
+            logging.WARNING: yellow,
+            logging.ERROR: red,
+            logging.CRITICAL: bold_red
         }
 
+        def __init__(self, color=True):
+            super().__init__(self.format_str, datefmt='%H:%M:%S')
+            # 每个级别的格式器只创建一次，输出不是终端时不加颜色
+            self._formatters = {
+                level: logging.Formatter(code + self.format_str + self.reset, datefmt='%H:%M:%S')
+                for level, code in self.COLORS.items()
+            } if color else {}
+
         def format(self, record):
-            log_fmt = self.FORMATS.get(record.levelno)
-            formatter = logging.Formatter(log_fmt, datefmt='%H:%M:%S')
+            formatter = self._formatters.get(record.levelno)
+            if formatter is None:
+                return super().format(record)
             return formatter.format(record)
 
     # 配置日志处理器
-    handler = logging.StreamHandler()
-    handler.setFormatter(CustomFormatter())
+    if handler is None:
+        handler = logging.StreamHandler()
+        # sys.stderr可能为None（pythonw）或不带isatty的对象，此时不加颜色
+        isatty = getattr(handler.stream, 'isatty', None)
+        handler.setFormatter(CustomFormatter(color=bool(isatty and isatty())))
     
     # 配置根日志记录器
     root_logger = logging.getLogger()
@@ -54,142 +115,424 @@ def setup_logging(debug=False):
     root_logger.handlers = []
     root_logger.addHandler(handler)
 
-def singleton(cls):
-    """单例模式装饰器"""
-    _instance = {}
-    
-    def get_instance(*args, **kwargs):
-        if cls not in _instance:
-            _instance[cls] = cls(*args, **kwargs)
-        return _instance[cls]
-    
-    return get_instance
+@contextlib.contextmanager
+def file_lock(path):
+    """在多个进程之间互斥执行，无法加锁时不加锁继续执行"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, 'a+b')
+    except OSError as e:
+        logging.debug(f"无法打开锁文件 {path}: {e}")
+        yield
+        return
+    with f:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f, fcntl.LOCK_EX)
+            locked = True
+        except OSError as e:
+            logging.debug(f"无法锁定 {path}: {e}")
+            locked = False
+        try:
+            yield
+        finally:
+            if locked:
+                if os.name == 'nt':
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(f, fcntl.LOCK_UN)
 
 class RateLimiter:
     def __init__(self, rate=2):  # rate: 每秒允许的请求数
         self.rate = rate
         self.tokens = rate  # 当前可用令牌数
-        self.last_update = time.time()
+        self.last_update = time.monotonic()
         self.lock = Lock()
     
     def acquire(self):
         with self.lock:
-            now = time.time()
-            # 计算从上次更新到现在应该添加的令牌
+            now = time.monotonic()
+            # 计算从上次更新到现在应该添加的令牌（已被预约的时间段内为负）
             elapsed = now - self.last_update
             self.tokens = min(self.rate, self.tokens + elapsed * self.rate)
             self.last_update = now
             
-            if self.tokens < 1:
-                # 需要等待的时间
-                wait_time = (1 - self.tokens) / self.rate
-                time.sleep(wait_time)
-                self.tokens = 0
-                self.last_update = time.time()
-            else:
+            if self.tokens >= 1:
                 self.tokens -= 1
+                return
+            
+            # 预约下一个令牌的时间，释放锁后再等待，其他线程可以同时排队
+            wait_time = (1 - self.tokens) / self.rate
+            self.tokens = 0
+            self.last_update = now + wait_time
+        time.sleep(wait_time)
+
+class OrientationCache:
+    """页面图像哈希到方向结果的缓存，同时写入sqlite以便下次运行复用"""
+    def __init__(self, path):
+        self.memory = {}
+        self.lock = Lock()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS orientation (hash BLOB PRIMARY KEY, direction INTEGER)")
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"无法打开OCR结果缓存，仅在内存中缓存: {e}")
+            self.conn = None
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                return self.memory[key]
+            if self.conn is None:
+                return None
+            try:
+                row = self.conn.execute("SELECT direction FROM orientation WHERE hash = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                # 多进程处理时数据库可能正被其他进程写入
+                logging.debug(f"读取OCR结果缓存失败: {e}")
+                return None
+            if row is None:
+                return None
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key, direction):
+        with self.lock:
+            self._remember(key, direction)
+            if self.conn is not None:
+                try:
+                    self.conn.execute("INSERT OR REPLACE INTO orientation VALUES (?, ?)", (key, direction))
+                    self.conn.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"写入OCR结果缓存失败: {e}")
+
+    def _remember(self, key, direction):
+        self.memory[key] = direction
+        if len(self.memory) > ORIENTATION_CACHE_SIZE:
+            # 丢弃最早加入的结果
+            del self.memory[next(iter(self.memory))]
 
-@singleton
 class PDFRotator:
-    def __init__(self, api_key, secret_key):
+    def __init__(self, api_key, secret_key, rate=OCR_QPS, workers=4):
         self.api_key = api_key
         self.secret_key = secret_key
-        self.token = self.get_access_token()
-        self.rate_limiter = RateLimiter(rate=2)
-        # 在初始化时定义可用的API列表和失败计数器
-        self.available_api_list = [
+        import requests # requests
+        from urllib3.util.retry import Retry # requests的依赖
+        # 复用HTTPS连接，避免每次请求重新握手；连接池大小需不小于工作线程数
+        self.session = requests.Session()
+        # 连接失败及服务端错误(5xx)时按指数退避自动重试；这些重试不经过RateLimiter，
+        # 但最多3次且有退避间隔，有意保留
+        # 限流(429)不在此重试（也不按Retry-After等待），交给get_result_from_api经过RateLimiter后重试
+        # 读取超时时请求可能已被服务端处理并计费，不再重发(read=0)
+        retry = Retry(total=3, read=0, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'POST'}), raise_on_status=False,
+                      respect_retry_after_header=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=max(16, workers), max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json'
+        })
+        # access_token在首次请求时获取
+        self.token_lock = Lock()
+        self.token = None
+        self.rate_limiter = RateLimiter(rate=rate)
+        # 可用的API及其连续失败次数，按历史成功次数排序
+        self.apis = OrderedDict((api, 0) for api in [
             "handwriting",
             "general_basic",
             "general",
             # "accurate_basic", 
             # "accurate",
             # "webimage",
-        ]
-        # 初始化失败计数器字典
-        self.api_fail_count = {api: 0 for api in self.available_api_list}
+        ])
+        self.api_success = Counter()
         # 设置最大失败次数
         self.max_fail_count = 3
+        # 最近一次调用成功的接口
+        self._preferred_api = None
+        # 按图像哈希缓存的识别结果
+        self.orientation_cache = OrientationCache(ORIENTATION_CACHE_FILE)
+        # 多线程调用时保护接口列表和失败计数
+        self.lock = Lock()
 
-    def get_access_token(self):
-        """获取百度AI的access_token"""
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {
-            "grant_type": "client_credentials", 
-            "client_id": self.api_key, 
-            "client_secret": self.secret_key
-        }
-        return str(requests.post(url, params=params).json().get("access_token"))
+    def get_access_token(self, stale_token=None):
+        """获取百度AI的access_token，优先使用本地缓存中未过期且不是stale_token的token"""
+        # 多个进程同时启动时只有第一个进程请求token，其余进程等它写入缓存后直接读取
+        with file_lock(TOKEN_LOCK_FILE):
+            token = self._load_cached_token()
+            if token and token != stale_token:
+                return token
+
+            url = "https://aip.baidubce.com/oauth/2.0/token"
+            params = {
+                "grant_type": "client_credentials", 
+                "client_id": self.api_key, 
+                "client_secret": self.secret_key
+            }
+            result = self.session.post(url, params=params, timeout=REQUEST_TIMEOUT).json()
+            if "access_token" in result:
+                self._save_cached_token(result["access_token"], time.time() + result.get("expires_in", 0))
+            return str(result.get("access_token"))
 
-    def get_result_from_api(self, image, api_name):
+    def current_token(self):
+        """返回当前access_token，尚未获取时先获取"""
+        with self.token_lock:
+            if self.token is None:
+                self.token = self.get_access_token()
+            return self.token
+
+    def refresh_token(self, stale_token):
+        """重新获取access_token，多个线程同时发现失效时只刷新一次"""
+        with self.token_lock:
+            if self.token == stale_token:
+                logging.warning("access_token已失效，重新获取")
+                self.token = self.get_access_token(stale_token)
+
+    def _load_cached_token(self):
+        try:
+            with open(TOKEN_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 只使用同一API Key获取的token，提前5分钟视为过期
+        if cache.get('api_key_hash') == self._api_key_hash() and time.time() < cache.get('expires_at', 0) - 300:
+            return cache.get('token')
+        return None
+
+    def _save_cached_token(self, token, expires_at):
+        cache = {'api_key_hash': self._api_key_hash(), 'token': token, 'expires_at': expires_at}
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_file = TOKEN_CACHE_FILE + '.tmp'
+            # access_token相当于30天有效的凭据，缓存文件只允许当前用户读写
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.chmod(tmp_file, 0o600)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmp_file, TOKEN_CACHE_FILE)
+        except OSError as e:
+            logging.warning(f"保存access_token缓存失败: {e}")
+
+    def _api_key_hash(self):
+        # 缓存文件中不保存明文API Key
+        return hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()
+
+    def get_result_from_api(self, body, api_name):
+        token = self.current_token()
+        result = self._request_ocr(body, api_name, token)
+        if result.get("error_code") in TOKEN_ERROR_CODES:
+            # access_token无效或过期，刷新后重试一次
+            self.refresh_token(token)
+            result = self._request_ocr(body, api_name, self.token)
+        for attempt in range(RATE_LIMIT_RETRIES):
+            if result.get("error_code") not in RATE_LIMIT_ERROR_CODES:
+                break
+            # 被限流时指数退避后重试，加入随机抖动避免各线程同时重发
+            delay = RATE_LIMIT_BACKOFF * 2 ** attempt + random.uniform(0, 0.1)
+            logging.debug(f"接口 {api_name} 请求过于频繁，{delay:.2f} 秒后重试")
+            time.sleep(delay)
+            result = self._request_ocr(body, api_name, self.token)
+        return result
+
+    def _request_ocr(self, body, api_name, token):
         # 在发送请求前获取令牌
         self.rate_limiter.acquire()
         
-        img_str = self._image_to_base64(image)
-        url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/{api_name}?access_token={self.token}"
-
-        payload = {
-            "image": img_str,
-            "detect_direction": "true",
-        }
-
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'application/json'
-        }
+        url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/{api_name}?access_token={token}"
 
-        response = requests.post(url, headers=headers, data=payload)
+        response = self.session.post(url, data=body, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 401:
+            # 与access_token无效同样处理
+            return {"error_code": 110, "error_msg": "HTTP 401 Unauthorized"}
+        if response.status_code == 429:
+            # 与QPS超限同样处理
+            return {"error_code": 18, "error_msg": "HTTP 429 Too Many Requests"}
         result = response.json()
         return result
 
-    def auto_switch_api(self, image):
-        for api in self.available_api_list:
-            result = self.get_result_from_api(image, api)
-            if result.get("direction") is not None:
-                # 成功时重置失败计数
-                self.api_fail_count[api] = 0
-                return result
-            else:
+    def auto_switch_api(self, image_bytes):
+        # 相同图像（如重复的封面、空白页）直接复用之前的识别结果
+        image_key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        direction = self.orientation_cache.get(image_key)
+        if direction is not None:
+            return {"direction": direction}
+
+        # 请求体只编码一次，切换接口时直接复用
+        body = urlencode({
+            "image": self._bytes_to_base64(image_bytes),
+            "detect_direction": "true",
+        }).encode('ascii')
+        with self.lock:
+            api_list = list(self.apis)
+        # 优先尝试上次成功的接口，避免每页都在不可用的接口上浪费一次请求
+        preferred_api = self._preferred_api
+        if preferred_api in api_list:
+            api_list.remove(preferred_api)
+            api_list.insert(0, preferred_api)
+        
+        # 达到失败上限的接口在本次尝试结束后统一移除
+        to_remove = set()
+        try:
+            for api in api_list:
+                result = self.get_result_from_api(body, api)
+                if result.get("direction") is not None:
+                    with self.lock:
+                        # 成功时重置失败计数
+                        if api in self.apis:
+                            self.apis[api] = 0
+                        self.api_success[api] += 1
+                        if sum(self.api_success.values()) % API_REORDER_INTERVAL == 0:
+                            self._reorder_apis()
+                        self._preferred_api = api
+                    self.orientation_cache.put(image_key, result["direction"])
+                    return result
+                
                 logging.warning(f"接口不可用: {api}, Error Code: {result.get('error_code')}, Error Message: {result.get('error_msg')}")
-                self.api_fail_count[api] += 1
-            
-            # 检查失败次数是否达到上限
-            if self.api_fail_count[api] >= self.max_fail_count:
-                logging.warning(f"接口 {api} 连续失败 {self.max_fail_count} 次，从可用列表中移除")
-                self.available_api_list.remove(api)
-                del self.api_fail_count[api]
+                with self.lock:
+                    if api not in self.apis:
+                        # 已被其他线程移除
+                        continue
+                    self.apis[api] += 1
+                    
+                    # 检查失败次数是否达到上限
+                    if self.apis[api] >= self.max_fail_count:
+                        logging.warning(f"接口 {api} 连续失败 {self.max_fail_count} 次，从可用列表中移除")
+                        to_remove.add(api)
+                        if self._preferred_api == api:
+                            self._preferred_api = None
+        finally:
+            if to_remove:
+                with self.lock:
+                    for api in to_remove:
+                        self.apis.pop(api, None)
         
-        if not self.available_api_list:
+        if not self.apis:
             logging.error("没有可用的OCR接口")
             sys.exit(1)
         else:
             raise Exception("所有接口均尝试失败，本页不调整")
 
-    def _image_to_base64(self, image):
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG", quality=95)
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return img_str
+    def _reorder_apis(self):
+        """按历史成功次数重新排列接口，成功次数相同时保持原有顺序"""
+        self.apis = OrderedDict(sorted(self.apis.items(), key=lambda item: -self.api_success[item[0]]))
+
+    def _bytes_to_base64(self, image_bytes):
+        return base64.b64encode(image_bytes).decode('ascii')
+
+def extract_page_jpeg(page, max_edge=OCR_MAX_EDGE):
+    """页面只有一张正向铺满的JPEG图片时（常见于扫描件）返回其原始数据，否则返回None"""
+    if page.rotation != 0:
+        return None
+    images = page.get_images(full=True)
+    if len(images) != 1:
+        return None
+    xref = images[0][0]
+    rects = page.get_image_rects(xref, transform=True)
+    if len(rects) != 1:
+        return None
+    bbox, matrix = rects[0]
+    # 图片不能带旋转或翻转，且要覆盖页面的绝大部分
+    if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+        return None
+    if bbox.get_area() < FAST_PATH_MIN_COVERAGE * page.rect.get_area():
+        return None
+    
+    info = page.parent.extract_image(xref)
+    if info.get("ext") not in ("jpeg", "jpg") or info.get("colorspace") not in (1, 3):
+        return None
+    # 分辨率更高的图片上传代价大于渲染，交给渲染流程缩小
+    if max(info["width"], info["height"]) > max_edge or len(info["image"]) > OCR_MAX_BYTES:
+        return None
+    return info["image"]
+
+def get_image_from_pdf(page, max_edge=OCR_MAX_EDGE):
+    """获取用于OCR的页面JPEG字节"""
+    import fitz  # PyMuPDF
+    # 扫描页直接使用内嵌的JPEG，省去解码、渲染和重新编码
+    try:
+        image_bytes = extract_page_jpeg(page, max_edge)
+    except Exception as e:
+        logging.debug(f"提取内嵌图片失败，改为渲染页面: {e}")
+        image_bytes = None
+    if image_bytes is not None:
+        return image_bytes
+    
+    # 方向检测不需要高分辨率和颜色：按OCR_DPI渲染灰度图，且长边不超过max_edge
+    zoom = min(OCR_DPI / 72, max_edge / max(page.rect.width, page.rect.height))
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False, annots=False)
+    quality = 85
+    image_bytes = pix.tobytes("jpeg", jpg_quality=quality)
+    # 超出接口的图片大小限制时降低质量重新编码
+    while len(image_bytes) > OCR_MAX_BYTES and quality > 25:
+        quality -= 20
+        image_bytes = pix.tobytes("jpeg", jpg_quality=quality)
+    return image_bytes
+
+def text_layer_rotation(page):
+    """根据文字层中各行的书写方向推断页面需要旋转的角度，文字过少时返回None"""
+    import fitz  # PyMuPDF
+    if page.rotation != 0:
+        return None
+    
+    # 按字符数统计各书写方向，取占多数的方向
+    votes = Counter()
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block.get("lines", ()):
+            chars = sum(len(span["text"].strip()) for span in line["spans"])
+            if chars:
+                # dir为书写方向的(cos, sin)，页面坐标y轴向下
+                dx, dy = line["dir"]
+                votes[round(math.degrees(math.atan2(-dy, dx)) / 90) % 4 * 90] += chars
+    
+    if sum(votes.values()) <= TEXT_LAYER_MIN_CHARS:
+        return None
+    return votes.most_common(1)[0][0]
+
+def looks_upright(page):
+    """根据水平/垂直投影判断页面文字行是否水平排列
 
-def get_image_from_pdf(page):
-    """从PDF页面中提取图像"""
-    pix = page.get_pixmap()
-    img = Image.open(io.BytesIO(pix.tobytes("png")))
-    return img
+    横排文字的行投影在文字行与行间空白之间交替，方差明显大于列投影。
+    该方法无法区分正向与倒置（180度），只适合确认没有倒置页面的文件。
+    """
+    import fitz  # PyMuPDF
+    zoom = LOCAL_CHECK_EDGE / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False, annots=False)
+    width, height, stride = pix.width, pix.height, pix.stride
+    # 二值化：深色像素为1，其余为0
+    dark = pix.samples.translate(_DARK_PIXEL_TABLE)
+    
+    total = sum(dark)
+    if not 0.01 < total / (width * height) < 0.5:
+        # 空白页或大面积深色的页面交给OCR判断
+        return False
+    
+    row_ratios = [sum(dark[y * stride:y * stride + width]) / width for y in range(height)]
+    col_ratios = [sum(dark[x:height * stride:stride]) / height for x in range(width)]
+    col_variance = statistics.pvariance(col_ratios)
+    if col_variance == 0:
+        return False
+    return statistics.pvariance(row_ratios) / col_variance > LOCAL_CHECK_RATIO
 
-def detect_orientation(image, config):
+@functools.lru_cache(maxsize=4)
+def get_rotator(api_key, secret_key, rate=OCR_QPS, workers=4):
+    """按密钥获取PDFRotator实例，同一组密钥只创建一次"""
+    return PDFRotator(api_key, secret_key, rate, workers)
+
+def detect_orientation(ocr, image_bytes):
     """使用百度OCR检测图像方向"""
-    ocr = PDFRotator(config['api_key'], config['secret_key'])
-    result = ocr.auto_switch_api(image)
+    result = ocr.auto_switch_api(image_bytes)
     
     if 'direction' in result:
-        # 百度OCR返回的direction: 0:正向，1:逆时针90度，2:逆时针180度，3:逆时针270度
-        direction_map = {
-            0: 0,
-            1: 90,
-            2: 180,
-            3: 270
-        }
-        angle = direction_map.get(result['direction'], 0)
+        direction = result['direction']
+        angle = _BAIDU_DIR[direction] if direction in range(len(_BAIDU_DIR)) else 0
         return angle, 1.0
     else:
         raise Exception("未检测到方向信息")
@@ -226,44 +569,89 @@ class ProcessStats:
 
 def correct_pdf_orientation(input_pdf, output_pdf, config):
     """自动校正PDF页面方向"""
+    import fitz  # PyMuPDF
     success_count = 0
     fail_count = 0
 
-    doc = fitz.open(input_pdf)
-    total_pages = len(doc)
+    with fitz.open(input_pdf) as doc:
+        total_pages = len(doc)
     
-    if total_pages == 0:
-        logging.warning("PDF文件为空")
-        doc.close()
-        return total_pages, success_count, fail_count
+        if total_pages == 0:
+            logging.warning("PDF文件为空")
+            return total_pages, success_count, fail_count
         
-    logging.info(f"PDF文件共 {total_pages} 页")
+        logging.info(f"PDF文件共 {total_pages} 页")
     
-    for page_num in range(total_pages):
-        try:
-            page = doc[page_num]
-            
-            # 提取页面图像
-            image = get_image_from_pdf(page)
-            
-            # 获取旋转角度和置信度
-            rotation, confidence = detect_orientation(image, config)
-            
-            # 根据检测结果旋转页面
-            if rotation != 0:
-                page.set_rotation(rotation)
-                success_count += 1
-                logging.info(f"第 {page_num + 1} 页: 旋转 {rotation}° (置信度: {confidence:.2f})")
-            else:
-                logging.debug(f"第 {page_num + 1} 页: 无需旋转 (置信度: {confidence:.2f})")
+        # 页面渲染在主线程中依次进行（PyMuPDF不是线程安全的），OCR请求交给线程池并发执行
+        workers = config.get('workers', 4)
+        # 多个进程同时请求时平分接口的每秒请求数
+        rate = config.get('ocr_qps', OCR_QPS) / max(1, config.get('procs', 1))
+        ocr = get_rotator(config['api_key'], config['secret_key'], rate, workers)
+        # 限制已渲染但尚未完成识别的页数，避免渲染远远领先于请求而占用大量内存
+        pending = BoundedSemaphore(workers * 2)
+        futures = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page_num in range(total_pages):
+                try:
+                    page = doc[page_num]
                 
-        except Exception as e:
-            fail_count += 1
-            logging.error(f"处理第 {page_num + 1} 页时出错: {str(e)}")
+                    # 已有文字层的页面根据文字的书写方向判断，无需OCR
+                    rotation = text_layer_rotation(page)
+                    if rotation is not None:
+                        logging.debug(f"第 {page_num + 1} 页: 根据文字层判断方向，跳过OCR")
+                        future = Future()
+                        future.set_result((rotation, 1.0))
+                        futures.append((page_num, future))
+                        continue
+                
+                    # 可选的本地预检：文字行明显水平排列时不再调用OCR
+                    if config.get('local_skip') and looks_upright(page):
+                        logging.debug(f"第 {page_num + 1} 页: 本地预检判断为水平排列，跳过OCR")
+                        continue
+                
+                    pending.acquire()
+                    try:
+                        # 提取页面图像
+                        image_bytes = get_image_from_pdf(page)
+                        future = executor.submit(detect_orientation, ocr, image_bytes)
+                    except BaseException:
+                        pending.release()
+                        raise
+                    future.add_done_callback(lambda _: pending.release())
+                    futures.append((page_num, future))
+                except Exception as e:
+                    fail_count += 1
+                    logging.error(f"处理第 {page_num + 1} 页时出错: {str(e)}")
 
-    # 保存校正后的PDF
-    doc.save(output_pdf)
-    doc.close()
+            for page_num, future in futures:
+                try:
+                    # 获取旋转角度和置信度
+                    rotation, confidence = future.result()
+                
+                    # 根据检测结果旋转页面
+                    if rotation != 0:
+                        doc[page_num].set_rotation(rotation)
+                        success_count += 1
+                        logging.info(f"第 {page_num + 1} 页: 旋转 {rotation}° (置信度: {confidence:.2f})")
+                    else:
+                        logging.debug(f"第 {page_num + 1} 页: 无需旋转 (置信度: {confidence:.2f})")
+                    
+                except Exception as e:
+                    fail_count += 1
+                    logging.error(f"处理第 {page_num + 1} 页时出错: {str(e)}")
+
+        # 保存校正后的PDF
+        in_place = os.path.abspath(input_pdf) == os.path.abspath(output_pdf)
+        if success_count == 0:
+            # 没有页面被旋转，直接复制原文件，省去重新生成整个PDF
+            if not in_place:
+                shutil.copyfile(input_pdf, output_pdf)
+        elif in_place and doc.can_save_incrementally():
+            # 覆盖原文件时只追加修改的部分
+            doc.save(output_pdf, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+        else:
+            # 只修改了页面的旋转属性，不做垃圾回收和重新压缩，大文件保存时主要只剩磁盘读写
+            doc.save(output_pdf, garbage=0, deflate=False)
 
     # 输出最终结果
     if success_count > 0:
@@ -274,6 +662,41 @@ def correct_pdf_orientation(input_pdf, output_pdf, config):
     
     return total_pages, success_count, fail_count
 
+def iter_pdfs(folder):
+    """列出文件夹及其子文件夹下的所有PDF文件路径"""
+    # 用栈代替递归，目录层级很深时也不会有生成器嵌套的开销
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            it = os.scandir(current)
+        except OSError as e:
+            # 与os.walk一样跳过无法读取的文件夹，不影响其他文件
+            logging.warning(f"无法读取文件夹 {current}: {e}")
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(".pdf") and entry.is_file():
+                    yield entry.path
+
+def process_file(task):
+    """处理单个PDF文件，task为(输入路径, 输出路径, 配置)"""
+    input_pdf, output_pdf, config = task
+    logging.info(f"正在处理文件: {input_pdf}")
+    return correct_pdf_orientation(input_pdf, output_pdf, config)
+
+def _init_worker(debug):
+    """进程池子进程的初始化"""
+    # fork出的子进程继承了父进程替换过的sys.stdout/sys.stderr（如GUI的StreamToLogger，
+    # 写入后又回到日志系统，会无限递归），恢复为原始的标准输出
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    # 子进程的日志输出到控制台，不沿用父进程的处理器（如GUI的日志区域）；没有控制台时（pythonw）不输出
+    setup_logging(debug, None if sys.stderr is not None else logging.NullHandler())
+    # fork出的子进程不能复用父进程的HTTP连接
+    get_rotator.cache_clear()
+
 def process_folder(config, progress_callback=None):
     """递归扫描文件夹并修复所有PDF文件"""
     input_folder = config['input_folder']
@@ -281,28 +704,53 @@ def process_folder(config, progress_callback=None):
     
     stats = ProcessStats()
     
-    # 首先统计总文件数
-    stats.total_files = sum(1 for root, _, files in os.walk(input_folder) 
-                     for file in files if file.lower().endswith(".pdf"))
+    # 输入输出根目录只转换一次绝对路径，之后直接拼接
+    input_root = os.path.abspath(input_folder)
+    output_root = os.path.abspath(output_folder)
     
-    for root, _, files in os.walk(input_folder):
-        for file in files:
-            if file.lower().endswith(".pdf"):
-                # 获取相对路径
-                rel_path = os.path.relpath(root, input_folder)
-                
-                # 构建输入和输出路径
-                input_pdf = os.path.abspath(os.path.join(root, file))
-                output_dir = os.path.abspath(os.path.join(output_folder, rel_path))
-                os.makedirs(output_dir, exist_ok=True)
-                output_pdf = os.path.join(output_dir, file)
-                
-                logging.info(f"正在处理文件: {input_pdf}")
-                total_pages, rotated, failed = correct_pdf_orientation(input_pdf, output_pdf, config)
-                stats.add_file_result(total_pages, rotated, failed)
-                
-                if progress_callback:
-                    progress_callback(stats.processed_files, stats.total_files)
+    # 只遍历一次目录树，总文件数直接取列表长度；从绝对路径开始遍历，得到的文件路径也是绝对路径
+    pdf_files = list(iter_pdfs(input_root))
+    stats.total_files = len(pdf_files)
+    # 已创建的输出目录，同一目录下的文件不再重复调用makedirs
+    created_dirs = set()
+    
+    # 各文件互不相关，procs大于1时分给多个进程同时处理，绕开GIL对图像编码的限制
+    procs = max(1, min(config.get('procs', 1), len(pdf_files)))
+    # 按实际进程数平分接口的每秒请求数，文件数少于procs或顺序处理时不会白白降低速率
+    task_config = dict(config, procs=procs)
+    
+    tasks = []
+    for input_pdf in pdf_files:
+        # 获取相对路径，构建输出路径
+        rel_path = os.path.relpath(input_pdf, input_root)
+        output_pdf = os.path.join(output_root, rel_path)
+        output_dir = os.path.dirname(output_pdf)
+        if output_dir not in created_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            created_dirs.add(output_dir)
+        tasks.append((input_pdf, output_pdf, task_config))
+    
+    if procs > 1:
+        executor = ProcessPoolExecutor(procs, initializer=_init_worker, initargs=(config.get('debug', False),))
+        futures = [executor.submit(process_file, task) for task in tasks]
+        # 按完成顺序取结果，子进程中的异常（包括SystemExit）在主进程中重新抛出
+        results = (future.result() for future in as_completed(futures))
+    else:
+        executor = None
+        results = map(process_file, tasks)
+    
+    try:
+        for total_pages, rotated, failed in results:
+            stats.add_file_result(total_pages, rotated, failed)
+            
+            if progress_callback:
+                progress_callback(stats.processed_files, stats.total_files)
+    finally:
+        if executor is not None:
+            # 出错时不再启动尚未开始的文件
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
     
     # 输出汇总信息
     summary = stats.get_summary()
@@ -325,6 +773,10 @@ def load_config(config_file=None):
         'secret_key': None,
         'input_folder': None,
         'output_folder': None,
+        'workers': 4,
+        'procs': 1,
+        'ocr_qps': OCR_QPS,
+        'local_skip': False,
         'debug': False
     }
     
@@ -345,6 +797,9 @@ def parse_arguments():
     parser.add_argument("--secret-key", help="百度OCR Secret Key")
     parser.add_argument("--input-folder", help="输入文件夹路径")
     parser.add_argument("--output-folder", help="输出文件夹路径")
+    parser.add_argument("--workers", type=int, help="并发OCR请求的线程数")
+    parser.add_argument("--procs", type=int, help="同时处理PDF文件的进程数")
+    parser.add_argument("--ocr-qps", type=float, help="百度OCR接口每秒允许的请求数")
     parser.add_argument("--debug", action="store_true", help="启用调试模式")
     
     return parser.parse_args()
@@ -368,6 +823,12 @@ if __name__ == "__main__":
             config['input_folder'] = args.input_folder
         if args.output_folder:
             config['output_folder'] = args.output_folder
+        if args.workers:
+            config['workers'] = args.workers
+        if args.procs:
+            config['procs'] = args.procs
+        if args.ocr_qps:
+            config['ocr_qps'] = args.ocr_qps
         if args.debug:
             config['debug'] = True
             setup_logging(True)  # 重新设置日志级别